@@ -0,0 +1,127 @@
+import time
+started = time.time()
+
+import argparse
+import io
+import json
+import logging
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+import chardet
+
+import config
+import name_only_lib
+
+logger = logging.getLogger(__name__)
+
+# timings reported by GET /stats
+stats = {'cold_start_seconds': None, 'jobs': 0, 'failed_jobs': 0, 'aborted_jobs': 0,
+         'last_job_seconds': None, 'total_job_seconds': 0.0}
+
+# columns the roster csv must have, same as query_table.csv
+roster_columns = ['lname', 'fname', 'mname', 'orcid', 'start', 'end', 'affiliation']
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''
+    POST /query with a roster csv (same columns as query_table.csv) as the body.
+    the response is one json event per line, streamed as each term and publication completes,
+    ending with a "result" event holding the report tables and a "done" event with the job time.
+    GET /stats returns cold start and per job timings and cache sizes.
+    '''
+
+    def send_event(self, event):
+        self.wfile.write((json.dumps(event, default=str) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        body = dict(stats)
+        body['mean_job_seconds'] = stats['total_job_seconds'] / stats['jobs'] if stats['jobs'] > 0 else None
+        body['term_cache'] = len(name_only_lib.term_cache)
+        body['record_cache'] = len(name_only_lib.record_cache)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_error(404)
+            return
+        job_start = time.time()
+
+        # reject a missing or malformed roster before any streamed output
+        try:
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            roster = pd.read_csv(io.BytesIO(raw), encoding=chardet.detect(raw)['encoding'])
+            missing = [column for column in roster_columns if column not in roster.columns]
+            if len(missing) > 0:
+                raise ValueError('roster is missing columns: ' + ', '.join(missing))
+            if len(roster) == 0:
+                raise ValueError('roster has no rows')
+            # raises on bad start or end dates, warnings are reported again by run_query
+            name_only_lib.validate_query_table(roster.copy())
+        except Exception as e:
+            self.send_error(400, 'Invalid roster csv', explain=str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        status = 'failed'
+        try:
+            tables = name_only_lib.run_query(roster, config, progress=self.send_event, max_age=self.server.max_age)
+            results = {}
+            for name, table in tables.items():
+                results[name] = None if table is None else table.to_dict('records')
+            self.send_event({'event': 'result', 'tables': results})
+            status = 'done'
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away, nothing more can be written to the socket
+            status = 'aborted'
+        except Exception as e:
+            logger.exception('Query job failed')
+            try:
+                self.send_event({'event': 'error', 'message': str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                status = 'aborted'
+        finally:
+            seconds = time.time() - job_start
+            stats['jobs'] += 1
+            stats['last_job_seconds'] = seconds
+            stats['total_job_seconds'] += seconds
+            if status != 'done':
+                stats[status + '_jobs'] += 1
+            logger.info('Query job %i %s in %.2f seconds' % (stats['jobs'], status, seconds))
+
+        if status == 'done':
+            try:
+                self.send_event({'event': 'done', 'seconds': seconds})
+            except (BrokenPipeError, ConnectionResetError):
+                logger.warning('Client disconnected before job %i done event' % stats['jobs'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the pubmed query pipeline loaded and answer roster jobs over local http.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-age', type=int, default=86400,
+                        help='seconds cached pubmed search results and publication records are reused before querying again')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # jobs are handled one at a time, Entrez settings and the rate limit are shared by the whole process
+    server = HTTPServer((args.host, args.port), QueryHandler)
+    server.max_age = args.max_age
+
+    stats['cold_start_seconds'] = time.time() - started
+    logger.info('Ready on http://%s:%i after %.2f seconds cold start' % (args.host, args.port, stats['cold_start_seconds']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -7,6 +7,7 @@ import time
 import logging
 import pandas as pd
 import numpy as np
+import itertools
 
 def remove_bad_format(vals, checks, table_name):
     error_messages = []
@@ -109,13 +110,7 @@ def validate_query_table(table):
 		error_messages.append(end_date_checked[1])
 		table['end'] = end_date_checked[0]
 
-	if len(error_messages) == 0:
-		print('Successful validation of query_table.csv with no errors.')
-		time.sleep(2)
-	else:
-		print(error_messages)
-		time.sleep(10)
-	return table
+	return [table, error_messages]
 
 def name_variations(lname, fname, mname):
 	## Set Dev Values...
@@ -223,7 +218,8 @@ def orcid_query_term(orcid, start, end):
 
 
 def get_pmids(term):
-	pmids=''
+	# stays None if every attempt fails so callers can tell a failure from zero hits
+	pmids=None
 	attempt = 0
 	while attempt <= 3:
 	    try:
@@ -253,6 +249,46 @@ def get_pmids(term):
 	return pmids
 
 
+## Caches kept warm across run_query calls in a long-running process
+# term -> (time cached, pmids)
+term_cache = {}
+# (pmid, grants) -> (time cached, row from details())
+record_cache = {}
+
+
+def clear_caches():
+	term_cache.clear()
+	record_cache.clear()
+
+
+def prune_caches(max_age=86400):
+	# drop expired entries so a long-running process does not grow without limit
+	now = time.time()
+	for cache in [term_cache, record_cache]:
+		for key in [key for key, hit in cache.items() if now - hit[0] >= max_age]:
+			del cache[key]
+
+
+def cached_pmids(term, max_age=86400):
+	# reuse a recent esearch result for the same term, new pubs show up after max_age seconds
+	hit = term_cache.get(term)
+	if hit is not None and time.time() - hit[0] < max_age:
+		return [hit[1], True]
+	pmids = get_pmids(term)
+	if pmids is not None:
+		# failed queries (None) are not cached so the next job retries them
+		term_cache[term] = (time.time(), pmids)
+	return [pmids, False]
+
+
+def cached_record(pmid, grants, max_age=86400):
+	# parsed rows are re-fetched after max_age seconds since pmcid and nihmsid are added to records later
+	hit = record_cache.get((pmid, tuple(grants)))
+	if hit is not None and time.time() - hit[0] < max_age:
+		return hit[1]
+	return None
+
+
 ## Details function
 def details(pub, variations):
     # remove all white space and \n to help regex function
@@ -489,8 +525,15 @@ def details(pub, variations):
     return row
 
 
-## Summary function
-def summary(pmids, ncbi_key, grants):
+# columns of the rows returned by details()
+details_columns = ['pmid', 'pmcid', 'nihmsid',  'nctid', 'pub_title', 'authors',
+            'authors_lnames', 'authors_initials', 'authors_orcid', 'authors_affil',
+            'pub_date', 'epub_date', 'journal_short', 'journal_full', 'pubmed_tags', 'pub_type_list',
+            'exclude', 'mesh_major', 'mesh_minor', 'mesh_key', 'doi']
+
+
+## Fetch function, yields the publication xml for each batch of pmids as it arrives
+def fetch_records(pmids, ncbi_key):
 
     #***!!! developing !!!***
     Entrez.email = "Your.Name.Here@example.org"
@@ -502,7 +545,6 @@ def summary(pmids, ncbi_key, grants):
             from urllib2 import HTTPError # for Python 2
 
     count = len(pmids)
-    records = []
     attempt = 0
 
     while attempt < 3:
@@ -533,6 +575,7 @@ def summary(pmids, ncbi_key, grants):
     for start in range(0, count, batch_size):
         end = min(count, start+batch_size)
         logger.info('Going to fetch record %i to %i' % (start+1, end))
+        records = []
         attempt = 0
         while attempt < 3:
             attempt += 1
@@ -553,16 +596,117 @@ def summary(pmids, ncbi_key, grants):
                 else:
                     raise
 
-    pub_list = re.split('<PubmedArticle>', ''.join(records))
-    rows = []
-    for x in range(1, len(pub_list)):
-        # assemble list of publication details
-        rows.append(details(pub_list[x], grants))
+        yield re.split('<PubmedArticle>', ''.join(records))[1:]
 
 
-    pubs_frame = pd.DataFrame(rows, columns=['pmid', 'pmcid', 'nihmsid',  'nctid', 'pub_title', 'authors',
-            'authors_lnames', 'authors_initials', 'authors_orcid', 'authors_affil',
-            'pub_date', 'epub_date', 'journal_short', 'journal_full', 'pubmed_tags', 'pub_type_list',
-            'exclude', 'mesh_major', 'mesh_minor', 'mesh_key', 'doi'])
+## Summary function
+def summary(pmids, ncbi_key, grants):
+    rows = []
+    for batch in fetch_records(pmids, ncbi_key):
+        for pub in batch:
+            # assemble list of publication details
+            rows.append(details(pub, grants))
+
+    pubs_frame = pd.DataFrame(rows, columns=details_columns)
 
     return pubs_frame
+
+
+## Query function, runs the whole pipeline for a roster table (same columns as query_table.csv)
+def run_query(roster, config, progress=None, max_age=86400):
+    '''
+    config is any object with ncbi_api and grants attributes, e.g. the config module.
+    progress is called with a dict for each warning, term and publication as it completes.
+    returns a dict of the report tables; orcid_results is None if no orcid was given.
+    term and record caches are reused across calls in the same process for max_age seconds.
+    '''
+    if progress is None:
+        progress = lambda event: None
+
+    def warn(messages):
+        # validation messages may be nested lists from remove_bad_format
+        for message in messages:
+            if isinstance(message, list):
+                warn(message)
+            else:
+                progress({'event': 'warning', 'message': message})
+
+    #validate data and formats in config and the roster without changing either
+    grants = config.grants
+    val = validate_config(config.ncbi_api, grants[:] if isinstance(grants, list) else grants)
+    ncbi_api = val[0]
+    grants = val[1]
+    warn(val[2])
+
+    checked = validate_query_table(roster.copy())
+    data = checked[0]
+    warn(checked[1])
+    data.fillna('', inplace=True)
+
+    Entrez.email = "Your.Name.Here@example.org"
+    Entrez.api_key = ncbi_api
+
+    prune_caches(max_age)
+
+    def search(term):
+        pmids, cached = cached_pmids(term, max_age)
+        if pmids is None:
+            progress({'event': 'error', 'term': term, 'message': 'PubMed search failed after retries, results for this term are missing.'})
+            return ''
+        progress({'event': 'term', 'term': term, 'count': len(pmids), 'pmids': list(pmids), 'cached': cached})
+        return pmids
+
+    # create table for researchers with orcid ids and query pubmed for pmids in start and end date window
+    orcid_table = data[data.orcid != ''].reset_index()
+
+    if len(orcid_table) > 0:
+        orcid_table['term'] = orcid_table.apply(lambda x: orcid_query_term(x['orcid'], x['start'], x['end']), axis = 1)
+        orcid_table['pmids'] = orcid_table.apply(lambda x: search(x['term']), axis = 1)
+    else:
+        orcid_table = None
+
+    # create table of name variations for every researcher and query pubmed for pmids in start and end date window
+    names_table = pd.DataFrame(columns = ['name_variation'])
+    names_table.name_variation = data.apply(lambda x: name_variations(x['lname'], x['fname'], x['mname']), axis = 1)
+    names_table = flattenColumn(names_table, 'name_variation')
+    names_table = data.merge(names_table, left_index = True, right_index = True)
+
+    names_table['term'] = names_table.apply(lambda x: name_query_term(x['name_variation'], x['start'], x['end'], x['affiliation']), axis = 1)
+    names_table['pmids'] = names_table.apply(lambda x: search(x['term']), axis = 1)
+
+    if orcid_table is None:
+        pmids = list(set(itertools.chain(*names_table.pmids)))
+    else:
+        pmids = list(set(itertools.chain(*names_table.pmids, *orcid_table.pmids)))
+
+    ## get publication details, only fetching pmids not parsed recently with these grants
+    rows = {}
+    missing = []
+    for pmid in pmids:
+        row = cached_record(pmid, grants, max_age)
+        if row is None:
+            missing.append(pmid)
+        else:
+            rows[pmid] = row
+            progress({'event': 'publication', 'pmid': pmid, 'cached': True, 'row': dict(zip(details_columns, row))})
+    if len(missing) > 0:
+        for batch in fetch_records(missing, ncbi_api):
+            for pub in batch:
+                row = details(pub, grants)
+                record_cache[(row[0], tuple(grants))] = (time.time(), row)
+                rows[row[0]] = row
+                progress({'event': 'publication', 'pmid': row[0], 'cached': False, 'row': dict(zip(details_columns, row))})
+
+    pubs_frame = pd.DataFrame([rows[pmid] for pmid in pmids if pmid in rows], columns=details_columns)
+
+    ## add a column of name variations for each pmid to the end of pubs_frame
+    all_variations = []
+    for pmid in pubs_frame.pmid:
+        all_variations.append(names_table.name_variation[names_table['pmids'].astype(str).str.contains(pmid)].tolist())
+    pubs_frame['name_variations'] = all_variations
+
+    ## clean up the tables to be written as csv
+    pubs_frame = pubs_frame.replace(',', ';', regex=True)
+    pubs_frame = pubs_frame.apply(lambda x: x.str.slice(0, 30000))
+
+    return {'pmid_details': pubs_frame, 'names_results': names_table, 'orcid_results': orcid_table}